@@ -80,6 +80,24 @@ v1.2.1
  v1.3.7
  - Added function to remove Spotlights. Only standard, might not work with Steam Workshop spotlights
 
+ v1.4
+ - Added --merge-items to merge nearby floating objects of the same stackable item into single stacks instead of deleting them
+ - Added grid & block budgets (--budget-*). Grids over budget are evicted lowest priority first, grids with joints are left alone
+ - Backups and asteroid snapshot / respawn copies now run in the background while the save is being worked on. Saving waits for the backups to hit the disk
+ - Added --columnar, loads every block into NumPy arrays once and makes the cleanup decisions for the whole save in one go. Needs NumPy
+ - Added --reassign-dead-players, the "dead" player mode from v1.1. Removes IsDead players and hands everything they own or built over to nobody.
+    Only goes by IsDead, the AllPlayers list doesn't record when a player was last on so there's nothing to judge inactivity by
+ - Now processes every SANDBOX_x_y_z_.sbs sector file, not just SANDBOX_0_0_0_. Each sector is checked in its own worker process and
+    player pruning, budgets & asteroid respawns use the ownership & positions from all of them. Changes are staged to .tmp files
+    and only swapped in once every sector has been checked and everything is backed up
+ - Reads & writes gzip / zstd compressed saves directly, no need to decompress them first. Use --compression-level to set how hard they get squashed
+ - Added --remove-duplicate-grids to clear out stacks of identical grids sitting on top of each other
+ - Added --diff to compare two saves, reports added / removed / changed entities, blocks, players and factions
+ - Every run now adds a record of the world's size to a metrics history (--metrics-file). --trend shows how fast it's growing
+    and --trend-threshold predicts when it'll hit a limit
+ - Added --cleanup-characters to clear out characters & corpses of dead or departed players, keeping any near an owned grid.
+    --cleanup-unlinked-characters also clears out characters that can't be linked to a player
+
 
 """
 
@@ -90,13 +108,53 @@ import shutil #For copying files to backups
 import datetime #For timestamps
 import sys #for propper sys.exit()
 import traceback #For some error handling verbosity
+import glob #For finding all the sector files
+import concurrent.futures #For doing file copies in the background
+import multiprocessing #For spawning the sector workers
 import logging
+import logging.handlers #For getting the sector workers' logging back into the log file
+import math #For spatial grid cell maths
+import decimal #For adding up item amounts without float rounding
+import heapq #For picking the lowest priority grids to evict
+import array #For building up the columnar block table without a Python object per value
+import gzip #For reading & writing compressed saves
+import hashlib #For fingerprinting grid layouts
+import json #For the metrics history
+
+try:
+    import zstandard #Optional, only needed for zstd compressed saves
+except ImportError:
+    zstandard = None
+
+try:
+    import numpy as np #Optional, only needed for --columnar
+except ImportError:
+    np = None
 
 #########################################
 ### Functions ###########################
 #########################################
 logger = None
 
+#Power states for the columnar block table
+POWER_NONE = 0 #Not a power block
+POWER_SOURCE = 1 #Fueled reactor or charged battery
+POWER_DEAD = 2 #Empty reactor or dead battery
+POWER_SOLAR = 3 #Enabled solar panel, only counts if solar is included
+
+#Block attributes that make a joint, same as HasJoint
+JOINTATTRIBS = ["MyObjectBuilder_MotorRotor", "MyObjectBuilder_MotorStator", "MyObjectBuilder_PistonBase", "MyObjectBuilder_PistonTop"]
+
+#Item types that stack in an inventory. Anything else (gas bottles, hand tools) carries its own state and can't be merged
+STACKABLEITEMS = ["MyObjectBuilder_Ore", "MyObjectBuilder_Ingot", "MyObjectBuilder_Component", "MyObjectBuilder_AmmoMagazine"]
+
+#Magic bytes at the start of compressed save files
+GZIPMAGIC = b"\x1f\x8b"
+ZSTDMAGIC = b"\x28\xb5\x2f\xfd"
+
+#Things that can make a grid worth keeping when enforcing budgets, in their default order
+BUDGETPRIORITIES = ["powered", "owned", "static", "player", "blocks"]
+
 
 #Function to open the log
 def OpenLog():
@@ -143,7 +201,7 @@ def FindObjectName(objectcluster):
     for obj in objectcluster:
         if obj.find('DisplayName') is not None: #if a name has been specified under the Info tab
             if obj.find('DisplayName').text is not None: #Blank name, ignore it
-                foundnames.append(SafeString(object.find('DisplayName').text))
+                foundnames.append(SafeString(obj.find('DisplayName').text))
 
         for block in obj.find('CubeBlocks'):
             attrib = FindAttrib(block)
@@ -364,7 +422,8 @@ def DisableFactories(objectcluster, mode):
 
 
 #Function to get a list of players that own at least a part of this object cluster
-def GetClusterOwners(objectcluster):
+#If a metrics dict is given, the largest refinery queue is picked up on the way through too, for the metrics history
+def GetClusterOwners(objectcluster, metrics=None):
     shareholders = []
 
     for obj in objectcluster:
@@ -373,6 +432,9 @@ def GetClusterOwners(objectcluster):
                 if not cube.find('Owner').text in shareholders: #If this owner isn't currently recorded
                     shareholders.append(cube.find('Owner').text) #Add it to the list
 
+            if metrics is not None and FindAttrib(cube) == "MyObjectBuilder_Refinery" and cube.find('Queue') is not None:
+                metrics["largestrefineryqueue"] = max(metrics["largestrefineryqueue"], len(cube.find('Queue')))
+
     return shareholders
 
 
@@ -409,20 +471,10 @@ def IsClusterAnNPC(objectcluster):
 
 
 #Function to decide if it's safe to respawn an asteroid, based on the proximity of players and cubegrids
-def CanRespawnAsteroid(avoidcoordslist, entpos, saferange):
-
-    #Numbers are currently in strings. Convert to floats
-    entpos["x"] = float(entpos["x"])
-    entpos["y"] = float(entpos["y"])
-    entpos["z"] = float(entpos["z"])
-
-    for c in avoidcoordslist:
-        c["x"] = float(c["x"])
-        c["y"] = float(c["y"])
-        c["z"] = float(c["z"])
-        dist = (abs(c["x"] - entpos["x"]) + abs(c["y"] - entpos["y"]) + abs(c["z"] - entpos["z"]))
-        if dist < saferange: #If something is too close
-            return False #Do not respawn. God help you if you trap some poor bastard in an asteroid
+#avoidindex is a spatial index (BuildSpatialIndex) of everything that needs to be kept clear
+def CanRespawnAsteroid(avoidindex, cellsize, entpos, saferange):
+    if len(FindInRange(avoidindex, cellsize, entpos, saferange)) > 0: #If something is too close
+        return False #Do not respawn. God help you if you trap some poor bastard in an asteroid
 
     #Made it outside, must be good
     return True
@@ -431,17 +483,20 @@ def CanRespawnAsteroid(avoidcoordslist, entpos, saferange):
 #Function to save a backup of an asteroid / asteroid moon
 #With asteroids, we work with the Voxel files. Simple backups and overwrites
 #Graps if from the sectorobject's "FileName" node, so will always have the .vox extension included
-def SaveAsteroid(asteroidname):
+#The copy is handed to the IO executor, returns the job so it can be waited on (None if nothing was done)
+def SaveAsteroid(asteroidname, savedir, snapshotdir, ioexecutor, whatif=False):
     logger.info("Saving snapshot of asteroid: " + asteroidname)
 
     #First, make sure the snapshot folder exists
-    if not os.path.isdir(asteroidsnapshotdir):
+    if not os.path.isdir(snapshotdir):
         #and make it if it doesn't
-        os.makedirs(asteroidsnapshotdir)
+        os.makedirs(snapshotdir, exist_ok=True)
 
     #Do the copy
-    if not args.whatif:
-        shutil.copyfile(os.path.join(args.save_path, asteroidname), os.path.join(asteroidsnapshotdir, asteroidname))
+    if not whatif:
+        return ioexecutor.submit(FastCopyFile, os.path.join(savedir, asteroidname), os.path.join(snapshotdir, asteroidname))
+
+    return None
 
 
 #Function to loop through an object cluster and disable spotlights
@@ -460,14 +515,1222 @@ def DisableSpotLights(objectcluster):
 
 #Function to do the oposite, copy the contents of the snapshot back into the current voxel file
 #Once again, fields from the filename node so will have .vox on the end
-def RestoreAsteroid(asteroidname):
-    if os.path.isfile(os.path.join(asteroidsnapshotdir, asteroidname)): #Does a backup for that asteroid exist?
+#Same as SaveAsteroid, the copy goes to the IO executor and the job is returned
+def RestoreAsteroid(asteroidname, savedir, snapshotdir, ioexecutor, whatif=False):
+    if os.path.isfile(os.path.join(snapshotdir, asteroidname)): #Does a backup for that asteroid exist?
         logger.info("Respawning asteroid: " + asteroidname)
-        if not args.whatif:
-            shutil.copyfile(os.path.join(asteroidsnapshotdir,+ asteroidname), os.path.join(savedir, asteroidname))
+        if not whatif:
+            return ioexecutor.submit(FastCopyFile, os.path.join(snapshotdir, asteroidname), os.path.join(savedir, asteroidname))
     else: #If it doesn't exist
         logger.info("Unable to respawn asteroid, no backup exists: " + asteroidname)
 
+    return None
+
+
+#Function to copy a file as quick as the OS will let us
+#Tries copy_file_range, then sendfile, so the data never has to come up into Python. Falls back to a plain copy for whatever's left
+#Syncs the copy to disk before returning, a backup that's still sitting in the write cache isn't much of a backup
+def FastCopyFile(src, dst):
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        offset = 0
+
+        if hasattr(os, "copy_file_range"):
+            try:
+                while offset < size:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - offset, offset, offset)
+                    if copied == 0:
+                        break
+                    offset += copied
+            except OSError: #Not supported by this file system or across file systems, try the next way
+                pass
+
+        if offset < size and hasattr(os, "sendfile"):
+            try:
+                os.lseek(fdst.fileno(), offset, os.SEEK_SET) #sendfile writes at the current position
+                while offset < size:
+                    copied = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, size - offset)
+                    if copied == 0:
+                        break
+                    offset += copied
+            except OSError:
+                pass
+
+        if offset < size: #Windows, or both of the above fell over
+            fsrc.seek(offset)
+            fdst.seek(offset)
+            shutil.copyfileobj(fsrc, fdst)
+
+        fdst.flush()
+        os.fsync(fdst.fileno())
+
+
+#Function to wait for a list of IO executor jobs to finish. Passes on the first error any of them hit
+def WaitForIO(jobs):
+    for job in jobs:
+        if job is not None:
+            job.result()
+
+
+#Function to give a string a small integer code. The same string always gets the same code, and only one copy of it is kept
+def InternString(strings, value):
+    if value is None:
+        return -1
+
+    code = strings["codes"].get(value)
+    if code is None:
+        code = len(strings["values"])
+        strings["codes"][value] = code
+        strings["values"].append(value)
+
+    return code
+
+
+#Function to get the power state of a block for the columnar block table
+def GetBlockPowerState(block, attrib):
+    if attrib == "MyObjectBuilder_Reactor":
+        return POWER_SOURCE if len(block.find('Inventory').find('Items')) > 0 else POWER_DEAD
+    if attrib == "MyObjectBuilder_BatteryBlock":
+        return POWER_SOURCE if block.find('CurrentStoredPower').text != '0' else POWER_DEAD
+    if attrib == "MyObjectBuilder_SolarPanel" and block.find('Enabled').text == "true":
+        return POWER_SOLAR
+
+    return POWER_NONE
+
+
+#Function to pull every block in the save out into NumPy arrays, one row per block
+#Strings (attributes, subtypes, owners) are stored as interned integer codes, so the thousands of repeated "MyObjectBuilder_*" strings only exist once
+def BuildBlockTable(sectorobjects):
+    strings = {"codes": {}, "values": []}
+    grids = []
+    gridindex = {}
+    blockgrid = array.array('i')
+    blocktype = array.array('i')
+    blocksubtype = array.array('i')
+    blockowner = array.array('i')
+    blockpower = array.array('b')
+    gridqueue = [] #Largest refinery queue on each grid, for the metrics history
+
+    for obj in sectorobjects:
+        if FindAttrib(obj) != "MyObjectBuilder_CubeGrid":
+            continue
+
+        gridcode = len(grids)
+        gridindex[obj] = gridcode
+        grids.append(obj)
+        gridqueue.append(0)
+
+        for block in obj.find('CubeBlocks'):
+            blockattrib = FindAttrib(block)
+            blockgrid.append(gridcode)
+            blocktype.append(InternString(strings, blockattrib))
+            blocksubtype.append(InternString(strings, block.find('SubtypeName').text))
+            blockowner.append(InternString(strings, block.find('Owner').text) if block.find('Owner') is not None else -1)
+            blockpower.append(GetBlockPowerState(block, blockattrib))
+
+            if blockattrib == "MyObjectBuilder_Refinery" and block.find('Queue') is not None:
+                gridqueue[gridcode] = max(gridqueue[gridcode], len(block.find('Queue')))
+
+    return {"strings": strings,
+            "grids": grids,
+            "gridqueue": gridqueue,
+            "gridindex": gridindex,
+            "blockgrid": np.frombuffer(blockgrid, dtype=np.int32),
+            "blocktype": np.frombuffer(blocktype, dtype=np.int32),
+            "blocksubtype": np.frombuffer(blocksubtype, dtype=np.int32),
+            "blockowner": np.frombuffer(blockowner, dtype=np.int32),
+            "blockpower": np.frombuffer(blockpower, dtype=np.int8)}
+
+
+#Function to turn a list of strings into their codes in the block table. Strings that never turned up are left out
+def GetStringCodes(table, values):
+    return [table["strings"]["codes"][v] for v in values if v in table["strings"]["codes"]]
+
+
+#Function to check, for every grid at once, if any of its blocks match
+def GridsWithAny(table, blockmask):
+    return np.bincount(table["blockgrid"][blockmask], minlength=len(table["grids"])) > 0
+
+
+#Function to make the DoIRemoveThisCluster decision for every grid in the block table at once
+#Returns a bool array, one per grid, True if it should be removed
+def ColumnarRemovalDecisions(table, findattribs, findsubtypes, musthavepower=False, allowsolar=False):
+    powered = table["blockpower"] == POWER_SOURCE
+    if allowsolar:
+        powered |= table["blockpower"] == POWER_SOLAR
+    haspower = GridsWithAny(table, powered)
+
+    wanted = np.isin(table["blocktype"], GetStringCodes(table, findattribs)) | np.isin(table["blocksubtype"], GetStringCodes(table, findsubtypes))
+    neededblock = GridsWithAny(table, wanted)
+
+    keep = (haspower | (not musthavepower)) & (neededblock | (len(findattribs) == 0 and len(findsubtypes) == 0))
+    return ~keep
+
+
+#Function to check which grids in the block table have a joint, one bool per grid
+def ColumnarHasJoint(table):
+    return GridsWithAny(table, np.isin(table["blocktype"], GetStringCodes(table, JOINTATTRIBS)))
+
+
+#Function to get the owners of every grid in the block table, same as GetClusterOwners but for all of them at once
+def ColumnarGridOwners(table):
+    owners = [[] for g in table["grids"]]
+    owned = table["blockowner"] >= 0
+    nstrings = max(len(table["strings"]["values"]), 1)
+
+    #Pack each (grid, owner) pair into one number so np.unique can find the distinct ones
+    pairs = np.unique(table["blockgrid"][owned].astype(np.int64) * nstrings + table["blockowner"][owned])
+    for grid, owner in zip((pairs // nstrings).tolist(), (pairs % nstrings).tolist()):
+        owners[grid].append(table["strings"]["values"][owner])
+
+    return owners
+
+
+#Function to remove players from every player & faction list in the small save
+def RemovePlayers(smallsave, playerIDtoremove):
+    playerIDtoremove = set(playerIDtoremove)
+
+    #AllPlayers section
+    playerlist = smallsave.find('AllPlayers')
+    for player in playerlist[:]:
+        if player.find('PlayerId').text in playerIDtoremove:
+            logger.info("Removing %s from All Players list" % player.find('PlayerId').text)
+            playerlist.remove(player)
+
+    #Players section. Yes, there's a second one
+    pllist = smallsave.find('Players')[0]
+    for player in pllist[:]:
+        if player.find('Value').find('PlayerId') is not None and player.find('Value').find('PlayerId').text in playerIDtoremove:
+            logger.info("Removing %s from Players list" % player.find('Value').find('PlayerId').text)
+            pllist.remove(player)
+
+    #Factions
+    #Loop through members of each faction.
+    for faction in smallsave.find('Factions').find('Factions'):
+        factionId = faction.find('FactionId').text
+        memberlist = faction.find('Members')
+        joinrequests = faction.find('JoinRequests')
+
+        #Cleanup Members
+        for member in memberlist[:]:
+            if member.find('PlayerId').text in playerIDtoremove:
+                logger.info("Removing %s from faction %s %s" % (member.find('PlayerId').text, factionId, SafeString(faction.find('Name').text)))
+                memberlist.remove(member)
+
+        #Cleanup Join Requests
+        for joinrequest in joinrequests[:]:
+            if joinrequest.find('PlayerId').text in playerIDtoremove:
+                logger.info("Removing %s from faction request list %s %s" % (joinrequest.find('PlayerId').text, factionId, SafeString(faction.find('Name').text)))
+                joinrequests.remove(joinrequest)
+
+    #Factions Players, yep another second one
+    factionplayers = smallsave.find('Factions').find('Players')[0]
+    for factionplayer in factionplayers[:]:
+        if factionplayer.find('Key').text in playerIDtoremove:
+            logger.info("Removing %s from faction player list" % factionplayer.find('Key').text)
+            factionplayers.remove(factionplayer)
+
+
+#Function to hand the blocks of removed players over to nobody, in Owner and BuiltBy
+#playerIDs should be a set, this gets called for every block in the save. Counts up how many blocks each player lost in reassigncounts
+def ReassignClusterOwnership(objectcluster, playerIDs, reassigncounts):
+    for obj in objectcluster:
+        for cube in obj.find('CubeBlocks'):
+            owner = cube.find('Owner')
+            if owner is not None and owner.text in playerIDs:
+                reassigncounts[owner.text] = reassigncounts.get(owner.text, 0) + 1
+                owner.text = "0"
+
+            builtby = cube.find('BuiltBy')
+            if builtby is not None and builtby.text in playerIDs:
+                builtby.text = "0"
+
+
+#Function to get an entity's position as a tuple of floats
+def GetEntityPosition(objnode):
+    pos = objnode.find('PositionAndOrientation').find('Position').attrib
+    return (float(pos["x"]), float(pos["y"]), float(pos["z"]))
+
+
+#Function to work out which cell of a spatial grid a position falls into
+def GetGridCell(pos, cellsize):
+    return (int(pos[0] // cellsize), int(pos[1] // cellsize), int(pos[2] // cellsize))
+
+
+#Function to build a spatial grid index out of a list of (position, value) pairs
+#Proximity checks then only need to look at the neighbouring cells instead of every entity in the save
+def BuildSpatialIndex(entries, cellsize):
+    index = {}
+    for pos, value in entries:
+        index.setdefault(GetGridCell(pos, cellsize), []).append((pos, value))
+
+    return index
+
+
+#Function to find the values in a spatial index that are within range of a position
+def FindInRange(index, cellsize, pos, searchrange):
+    found = []
+    reach = int(math.ceil(searchrange / cellsize)) #How many cells out we need to look
+    cx, cy, cz = GetGridCell(pos, cellsize)
+    maxdist = searchrange * searchrange
+
+    for x in range(cx - reach, cx + reach + 1):
+        for y in range(cy - reach, cy + reach + 1):
+            for z in range(cz - reach, cz + reach + 1):
+                for otherpos, value in index.get((x, y, z), []):
+                    dist = (otherpos[0] - pos[0]) ** 2 + (otherpos[1] - pos[1]) ** 2 + (otherpos[2] - pos[2]) ** 2
+                    if dist <= maxdist:
+                        found.append(value)
+
+    return found
+
+
+#Function to group a list of positions around seeds. The first ungrouped position becomes a seed and takes everything ungrouped within grouprange of it
+#Unlike chaining neighbours together, nothing in a group is ever further than grouprange from its seed. Returns a list of groups, each a list of indexes into the positions list with the seed first
+def GroupAroundSeeds(positions, grouprange):
+    index = BuildSpatialIndex([(positions[n], n) for n in range(len(positions))], grouprange)
+    grouped = set()
+    groups = []
+    for n in range(len(positions)):
+        if n in grouped:
+            continue
+
+        group = [n] + sorted(other for other in FindInRange(index, grouprange, positions[n], grouprange) if other != n and other not in grouped)
+        grouped.update(group)
+        groups.append(group)
+
+    return groups
+
+
+#Function to get the item type & subtype of a floating object. Same fields GetFloatingItemName reads
+def GetFloatingItemKey(objnode):
+    content = objnode.find('Item').find('PhysicalContent')
+    return (FindAttrib(content), content.find('SubtypeName').text)
+
+
+#Function to merge nearby floating objects of the same item into single stacks. Only stackable items are touched, see STACKABLEITEMS
+#Each group of matching objects is replaced by one object at the group's seed holding the total amount, so nobody loses anything and nothing moves more than mergerange
+def MergeFloatingObjects(sectorobjects, mergerange):
+    groups = {}
+    for obj in sectorobjects:
+        if FindAttrib(obj) == "MyObjectBuilder_FloatingObject":
+            key = GetFloatingItemKey(obj)
+            if key[0] in STACKABLEITEMS:
+                groups.setdefault(key, []).append(obj)
+
+    toremove = set()
+    for objs in groups.values():
+        if len(objs) < 2: #Nothing to merge with
+            continue
+
+        for cluster in GroupAroundSeeds([GetEntityPosition(o) for o in objs], mergerange):
+            if len(cluster) < 2:
+                continue
+
+            #Keep the seed object where it is, it becomes the merged stack
+            keeper = objs[cluster[0]]
+            total = decimal.Decimal(0) #Decimal so the amounts don't pick up float rounding junk
+            for n in cluster:
+                total += decimal.Decimal(objs[n].find('Item').find('Amount').text)
+
+            keeper.find('Item').find('Amount').text = str(total)
+
+            logger.info("Merging %d free-floating objects into one stack: %s x %s" % (len(cluster), GetFloatingItemName(keeper), str(total)))
+            for n in cluster[1:]:
+                toremove.add(objs[n])
+
+    if len(toremove) > 0:
+        sectorobjects[:] = [o for o in sectorobjects if o not in toremove]
+
+    return len(toremove)
+
+
+#Function to hash a CubeGrid's block layout, going by each block's type, subtype, position and orientation
+#Each block is hashed on its own and the hashes are added up, so block order doesn't matter and it only takes one pass over the blocks
+def GetGridLayoutHash(objnode):
+    total = 0
+    count = 0
+    for block in objnode.find('CubeBlocks'):
+        parts = [FindAttrib(block), block.find('SubtypeName').text or ""]
+        if block.find('Min') is not None:
+            parts += [block.find('Min').attrib.get(axis, "0") for axis in ("x", "y", "z")]
+        if block.find('BlockOrientation') is not None:
+            parts += ["%s=%s" % item for item in sorted(block.find('BlockOrientation').attrib.items())]
+
+        blockhash = hashlib.blake2b("|".join(parts).encode('utf-8'), digest_size=8).digest()
+        total = (total + int.from_bytes(blockhash, 'little')) % (2 ** 64)
+        count += 1
+
+    return (count, total)
+
+
+#Function to remove CubeGrids that are exact copies of another one sitting within tolerance of it. Paste accidents, respawn bugs, that sort of thing
+#Grids are bucketed by layout hash, then each bucket is grouped around keepers. Only copies within tolerance of the grid being kept are removed
+def RemoveDuplicateGrids(sectorobjects, tolerance, ignorejoint=False):
+    buckets = {}
+    for obj in sectorobjects:
+        if FindAttrib(obj) == "MyObjectBuilder_CubeGrid":
+            buckets.setdefault(GetGridLayoutHash(obj), []).append(obj)
+
+    toremove = set()
+    for grids in buckets.values():
+        if len(grids) < 2: #One of a kind
+            continue
+
+        for cluster in GroupAroundSeeds([GetEntityPosition(g) for g in grids], tolerance):
+            if len(cluster) < 2:
+                continue
+
+            keeper = grids[cluster[0]]
+            for n in cluster[1:]:
+                if HasJoint([grids[n]]) and not ignorejoint: #Same as everywhere else, don't touch anything with a joint
+                    logger.info("Skipping duplicate of %s with a joint: %s" % (keeper.find('EntityId').text, grids[n].find('EntityId').text))
+                    continue
+
+                logger.info("! Removing duplicate CubeGrid %s, copy of %s" % (grids[n].find('EntityId').text, keeper.find('EntityId').text))
+                toremove.add(grids[n])
+
+    if len(toremove) > 0:
+        sectorobjects[:] = [o for o in sectorobjects if o not in toremove]
+
+    return len(toremove)
+
+
+#Function to index who owns which character, for character cleanup. Comes from the small save
+#Returns (IDs of players still alive, character EntityId: player ID) using whichever link fields the save has
+def GetCharacterOwnerIndex(smallsave):
+    liveplayers = set()
+    characterowners = {}
+
+    for player in smallsave.find('AllPlayers'):
+        playerID = player.find('PlayerId').text
+        if player.find('IsDead') is None or player.find('IsDead').text != 'true':
+            liveplayers.add(playerID)
+
+        for fieldname in ('CharacterEntityId', 'PlayerEntityId'):
+            if player.find(fieldname) is not None and player.find(fieldname).text not in (None, '0'):
+                characterowners[player.find(fieldname).text] = playerID
+
+    #The second player list can have the link too
+    if smallsave.find('Players') is not None and len(smallsave.find('Players')) > 0:
+        for player in smallsave.find('Players')[0]:
+            value = player.find('Value')
+            if value is None or value.find('PlayerId') is None:
+                continue
+            for fieldname in ('CharacterEntityId', 'PlayerEntityId'):
+                if value.find(fieldname) is not None and value.find(fieldname).text not in (None, '0'):
+                    characterowners[value.find(fieldname).text] = value.find('PlayerId').text
+
+    return liveplayers, characterowners
+
+
+#Function to work out which player a character belongs to. The character's own owner field first, then the small save's index. None if nobody
+def GetCharacterOwner(objnode, characterowners):
+    if objnode.find('OwningPlayerIdentityId') is not None and objnode.find('OwningPlayerIdentityId').text not in (None, '0'):
+        return objnode.find('OwningPlayerIdentityId').text
+
+    return characterowners.get(objnode.find('EntityId').text)
+
+
+#Function to pick out characters whose player is gone or dead, unless they're within saferange of an owned CubeGrid
+#characters are the sector summaries' character records, from every sector. ownedgridpositions should only have the grids that are staying
+#Characters that can't be linked to a player could still belong to a live player who's logged out, so they're left alone unless removeunlinked is set
+#Seated characters live inside their cockpit block, not in SectorObjects, so they never turn up here. Returns the indexes of the characters to remove
+def SelectOrphanedCharacters(characters, liveplayers, ownedgridpositions, saferange, removeunlinked=False):
+    gridindex = BuildSpatialIndex([(pos, None) for pos in ownedgridpositions], saferange)
+
+    orphans = []
+    for n, character in enumerate(characters):
+        owner = character["owner"]
+        if owner is None and not removeunlinked: #No idea whose it is
+            continue
+        if owner is not None and owner in liveplayers: #Still has a living player
+            continue
+
+        if len(FindInRange(gridindex, saferange, character["position"], saferange)) > 0:
+            logger.info("Keeping orphaned character %s in %s, it's near an owned grid" % (character["id"], character["file"]))
+            continue
+
+        logger.info("! Removing orphaned character %s in %s, player: %s" % (character["id"], character["file"], owner if owner is not None else "<unknown>"))
+        orphans.append(n)
+
+    return orphans
+
+
+#Function to check if a cluster has the potential for power. Same rules as the --cleanup-unpowered check, but without the chatter
+def ClusterHasPower(objectcluster, allowsolar=False):
+    for obj in objectcluster:
+        for block in obj.find('CubeBlocks'):
+            attrib = FindAttrib(block)
+            if attrib == "MyObjectBuilder_Reactor" and len(block.find('Inventory').find('Items')) > 0: #Fueled reactor
+                return True
+            if attrib == "MyObjectBuilder_BatteryBlock" and block.find('CurrentStoredPower').text != '0': #Charged battery
+                return True
+            if attrib == "MyObjectBuilder_SolarPanel" and allowsolar and block.find('Enabled').text == "true":
+                return True
+
+    return False
+
+
+#Function to sum up what the budget enforcement needs to know about a cluster, so it doesn't need to hang on to the XML
+def GetBudgetRecord(objectcluster, allowsolar=False):
+    blockcount = 0
+    ownerblocks = {} #How many blocks each player owns, the biggest shareholder gets charged for the cluster
+    for obj in objectcluster:
+        for cube in obj.find('CubeBlocks'):
+            blockcount += 1
+            if cube.find('Owner') is not None and cube.find('Owner').text != "0":
+                owner = cube.find('Owner').text
+                ownerblocks[owner] = ownerblocks.get(owner, 0) + 1
+
+    mainowner = None
+    if len(ownerblocks) > 0:
+        mainowner = max(ownerblocks, key=ownerblocks.get)
+
+    static = False
+    for obj in objectcluster:
+        if obj.find('IsStatic') is not None and obj.find('IsStatic').text == 'true':
+            static = True
+
+    return {"id": objectcluster[0].find('EntityId').text,
+            "blocks": blockcount,
+            "owners": GetClusterOwners(objectcluster),
+            "owner": mainowner,
+            "powered": ClusterHasPower(objectcluster, allowsolar),
+            "static": static,
+            "joint": HasJoint(objectcluster),
+            "position": GetEntityPosition(objectcluster[0])}
+
+
+#Function to work out how much a budget record is worth keeping. Lower priorities get evicted first
+#Builds a tuple in the order of the given priority names, so the first one listed matters most
+def GetBudgetPriority(record, priorities, playerindex, playerrange):
+    key = []
+    for p in priorities:
+        if p == "powered":
+            key.append(1 if record["powered"] else 0)
+        elif p == "owned":
+            key.append(1 if record["owner"] is not None else 0)
+        elif p == "static":
+            key.append(1 if record["static"] else 0)
+        elif p == "player": #Closer to a player is worth more. Anything out of range counts as being right at the edge
+            nearest = playerrange
+            for pos in FindInRange(playerindex, playerrange, record["position"], playerrange):
+                nearest = min(nearest, math.sqrt((pos[0] - record["position"][0]) ** 2 + (pos[1] - record["position"][1]) ** 2 + (pos[2] - record["position"][2]) ** 2))
+            key.append(-nearest)
+        elif p == "blocks":
+            key.append(record["blocks"])
+
+    return tuple(key)
+
+
+#Function to check if a grid & block count is over a budget. A limit of 0 means no limit
+def IsOverBudget(grids, blocks, maxgrids, maxblocks):
+    return (maxgrids > 0 and grids > maxgrids) or (maxblocks > 0 and blocks > maxblocks)
+
+
+#Function to pick which clusters to evict to get under the per-owner and global budgets
+#Clusters with joints are never picked unless ignorejoint is set, but they still count towards the budget
+#Returns a list of (record index, reason) in the order they were picked
+def SelectBudgetEvictions(records, maxgrids, maxblocks, maxownergrids, maxownerblocks, priorities, playerpositions, playerrange, ignorejoint=False):
+    playerindex = BuildSpatialIndex([(pos, pos) for pos in playerpositions], playerrange)
+    priority = [GetBudgetPriority(r, priorities, playerindex, playerrange) for r in records]
+    evictions = []
+    evicted = set()
+
+    def evictable(n):
+        return n not in evicted and (ignorejoint or not records[n]["joint"])
+
+    #Per-owner budgets first, then whatever's left has to fit in the global budget
+    if maxownergrids > 0 or maxownerblocks > 0:
+        byowner = {}
+        for n in range(len(records)):
+            if records[n]["owner"] is not None:
+                byowner.setdefault(records[n]["owner"], []).append(n)
+
+        for owner, members in byowner.items():
+            grids = len(members)
+            blocks = sum(records[n]["blocks"] for n in members)
+            heap = [(priority[n], n) for n in members if evictable(n)]
+            heapq.heapify(heap)
+            while IsOverBudget(grids, blocks, maxownergrids, maxownerblocks) and len(heap) > 0:
+                n = heapq.heappop(heap)[1]
+                evicted.add(n)
+                evictions.append((n, "owner %s over budget" % owner))
+                grids -= 1
+                blocks -= records[n]["blocks"]
+
+            if IsOverBudget(grids, blocks, maxownergrids, maxownerblocks):
+                logger.warning("Owner %s is still over budget, the rest of their grids can't be safely removed" % owner)
+
+    grids = len(records) - len(evicted)
+    blocks = sum(records[n]["blocks"] for n in range(len(records)) if n not in evicted)
+    heap = [(priority[n], n) for n in range(len(records)) if evictable(n)]
+    heapq.heapify(heap)
+    while IsOverBudget(grids, blocks, maxgrids, maxblocks) and len(heap) > 0:
+        n = heapq.heappop(heap)[1]
+        evicted.add(n)
+        evictions.append((n, "global budget"))
+        grids -= 1
+        blocks -= records[n]["blocks"]
+
+    if IsOverBudget(grids, blocks, maxgrids, maxblocks):
+        logger.warning("Still over the global budget, the rest of the grids can't be safely removed")
+
+    return evictions
+
+
+#Function to work out what a save file's backup gets called. Timestamped for big backups
+def GetBackupName(savefilepath, timestamp=None):
+    if timestamp is not None:
+        return "%s.%s.backup" % (savefilepath, timestamp)
+
+    return "%s.backup" % savefilepath
+
+
+#Function to work out if a save file is compressed, going by the first few bytes. Returns "gzip", "zstd" or "" for plain XML
+def GetSaveCompression(savefilepath):
+    with open(savefilepath, 'rb') as f:
+        magic = f.read(4)
+
+    if magic.startswith(GZIPMAGIC):
+        return "gzip"
+    if magic.startswith(ZSTDMAGIC):
+        return "zstd"
+
+    return ""
+
+
+#Function to open a save file through the right (de)compressor. Everything streams, nothing gets decompressed to disk first
+#level is only used when writing, None uses the compressor's default
+def OpenSaveFile(savefilepath, mode, compression="", level=None):
+    if compression == "gzip":
+        return gzip.open(savefilepath, mode, compresslevel=level if level is not None else 9)
+
+    if compression == "zstd":
+        if zstandard is None:
+            logger.error("%s is zstd compressed, which needs the zstandard module installed." % os.path.basename(savefilepath))
+            sys.exit()
+        if 'w' in mode:
+            return zstandard.open(savefilepath, mode, cctx=zstandard.ZstdCompressor(level=level if level is not None else 3))
+        return zstandard.open(savefilepath, mode)
+
+    return open(savefilepath, mode)
+
+
+#Function to load a save file, compressed or not. Returns the tree and how it was compressed, so it can be written back the same way
+def LoadSave(savefilepath):
+    compression = GetSaveCompression(savefilepath)
+    if compression != "":
+        logger.info("%s is %s compressed" % (os.path.basename(savefilepath), compression))
+
+    with OpenSaveFile(savefilepath, 'rb', compression) as f:
+        return ET.parse(f), compression
+
+
+#Function to write a save file back out, compressed the same way it was loaded
+#storedname is the file name gzip keeps in its header, for when it's being written somewhere other than where it'll end up
+def WriteSave(savetree, savefilepath, compression="", level=None, storedname=None):
+    #Space Engineers freaks the fuck out if the top of the XML isn't juuuuuuust right
+    savetree.getroot().attrib["xmlns:xsd"] = "http://www.w3.org/2001/XMLSchema"
+    if compression == "gzip":
+        with open(savefilepath, 'wb') as raw, gzip.GzipFile(filename=storedname if storedname is not None else os.path.basename(savefilepath), mode='wb', compresslevel=level if level is not None else 9, fileobj=raw) as f:
+            savetree.write(f)
+        return
+
+    with OpenSaveFile(savefilepath, 'wb', compression, level) as f:
+        savetree.write(f)
+
+
+#Function to work out where a save file's changes get staged until every file is ready to be swapped in
+def GetStagedName(savefilepath):
+    return "%s.tmp" % savefilepath
+
+
+#Function to write a save file out to its staging file, synced to disk so it's safe to swap in later
+def StageSave(savetree, savefilepath, compression="", level=None):
+    stagedfilepath = GetStagedName(savefilepath)
+    WriteSave(savetree, stagedfilepath, compression, level, os.path.basename(savefilepath))
+    with open(stagedfilepath, 'rb+') as f:
+        os.fsync(f.fileno())
+
+
+#Function to swap every staged save file in over the real one. Only called once everything is staged and backed up
+def CommitStagedSaves(savefilepaths):
+    for savefilepath in savefilepaths:
+        logger.info("Saving %s..." % os.path.basename(savefilepath))
+        os.replace(GetStagedName(savefilepath), savefilepath)
+
+
+#Function to throw away any staged save files, leaving the real ones as they were
+def DiscardStagedSaves(savefilepaths):
+    for savefilepath in savefilepaths:
+        if os.path.isfile(GetStagedName(savefilepath)):
+            os.remove(GetStagedName(savefilepath))
+
+
+#Function to check if any of the budget limits have been set
+def IsBudgetEnabled(args):
+    return args.budget_grids > 0 or args.budget_blocks > 0 or args.budget_owner_grids > 0 or args.budget_owner_blocks > 0
+
+
+#Function to find every sector file in a save folder, SANDBOX_x_y_z_.sbs
+def FindSectorFiles(savedir):
+    return sorted(glob.glob(os.path.join(glob.escape(savedir), "SANDBOX_*_*_*_.sbs")))
+
+
+#Function to run a job for every sector. Each sector gets its own worker process when there's more than one
+#jobargs is a list of argument tuples, one per sector. Results come back in the same order
+#Workers are always spawned, never forked. The backup threads are copying away in the background and forking in the middle of that isn't safe
+def RunSectorJobs(job, jobargs, workers=0):
+    if len(jobargs) == 1 or workers == 1:
+        return [job(*a) for a in jobargs]
+
+    #Spawned workers start with no logging set up, so their log records get sent back here and go to the same log file & console
+    context = multiprocessing.get_context("spawn")
+    logqueue = context.Queue()
+    listener = logging.handlers.QueueListener(logqueue, *logging.getLogger().handlers, respect_handler_level=True)
+    listener.start()
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers if workers > 0 else None, mp_context=context, initializer=GetWorkerLogger, initargs=(logqueue,)) as pool:
+            jobs = [pool.submit(job, *a) for a in jobargs]
+            return [j.result() for j in jobs]
+    finally:
+        listener.stop()
+
+
+#Function to get the logger going in a worker process. Spawned workers start with nothing, so everything gets sent to logqueue for the main process to log
+#Jobs run in the main process already have the log open and just pick it up
+def GetWorkerLogger(logqueue=None):
+    global logger
+    logger = logging.getLogger()
+    if logqueue is not None:
+        logger.handlers = [logging.handlers.QueueHandler(logqueue)]
+        logger.setLevel(logging.INFO)
+    elif len(logger.handlers) == 0:
+        logging.basicConfig(format='%(levelname)-8s %(message)s', level='INFO')
+
+    return logger
+
+
+#Function to do the SectorObjects check on one sector file and stage the changes
+#The sector file itself is never touched here, the changes go to its staging file and main swaps them all in once every sector is done
+#Returns a compact summary of what's left in the sector, for the checks that need to see the whole save (player pruning, budgets, asteroids). None if the sector couldn't be checked
+#characterowners is the character owner index from GetCharacterOwnerIndex, only needed for character cleanup
+def ProcessSector(sectorfilepath, args, reassignplayers, characterowners=None):
+    GetWorkerLogger()
+    sectorfilename = os.path.basename(sectorfilepath)
+
+    logger.info("Loading %s file..." % sectorfilename)
+    xmllargesavetree, compression = LoadSave(sectorfilepath)
+    xmllargesave = xmllargesavetree.getroot()
+
+    #Try to find the Sector Objects node
+    if xmllargesave.find('SectorObjects') is None:
+        logger.error("Unable to locate SectorObjects node in %s!" % sectorfilename)
+        return None
+
+    sectorobjects = xmllargesave.find('SectorObjects')
+
+    #Merge floating objects before the big loop. Pointless if they're all about to be removed
+    if args.merge_items > 0 and not args.cleanup_items:
+        logger.info("===Merging free-floating objects...===")
+        mergedcount = MergeFloatingObjects(sectorobjects, args.merge_items)
+        logger.info("Merged away %d free-floating objects" % mergedcount)
+
+    #Remove duplicate grids before the big loop, no point checking copies that are going anyway
+    if args.remove_duplicate_grids > 0:
+        logger.info("===Removing duplicate grids...===")
+        duplicatecount = RemoveDuplicateGrids(sectorobjects, args.remove_duplicate_grids, args.ignore_joint)
+        logger.info("Removed %d duplicate grids" % duplicatecount)
+
+    #Columnar mode, work out the cleanup decisions for every grid up front
+    if args.columnar:
+        logger.info("Building block table...")
+        blocktable = BuildBlockTable(sectorobjects)
+        columnarremove = ColumnarRemovalDecisions(blocktable, args.cleanup_missing_attrib, args.cleanup_missing_subtype, args.cleanup_unpowered, args.cleanup_include_solar)
+        columnarjoint = ColumnarHasJoint(blocktable)
+        columnarowners = ColumnarGridOwners(blocktable)
+        logger.info("Block table: %d grids, %d blocks, %d distinct strings" % (len(blocktable["grids"]), len(blocktable["blockgrid"]), len(blocktable["strings"]["values"])))
+
+    #Init the ownership table
+    owningplayers = set()
+
+    #How many blocks each dead player had handed over to nobody
+    reassigncounts = {}
+
+    #Owned grids, for keeping characters near them. (EntityId, position)
+    ownedgrids = []
+
+    #Metrics for the growth history, counted on the way through
+    entitycounts = {}
+    blockcount = 0
+    metrics = {"largestrefineryqueue": 0}
+
+    #Big loop through entity list
+    logger.info("===Beginning SectorObject check on %s...===" % sectorfilename)
+
+    #Rewrote to be more dynamic and to allow treating multiple entites / objects as one (motor joins). Lets call these 'object clusters'
+    #Lets always treat things as a cluster. Even if it's a cluster of 1. Will need to modify functions to match
+    #Removing clusters this way should be safe. The big concern was that if I were to start removing mid-loop, not only
+    #   would my end point be changed, but so would the current position and objects would be skipped. This way,
+    #   as long as touching any part of the cluster reveals the entire cluster, it will never remove backwards, always forwards
+    i = 0
+    while i < len(sectorobjects):
+        #---If removing an entity, DO NOT i++ !!!---
+        obj = sectorobjects[i]
+        objectclass = FindAttrib(obj)
+
+        #print("Checking object")
+        #print(objectclass)
+
+        #---Process non-cubegrid stuff first---
+
+        #Remove free floating objects
+        if objectclass == "MyObjectBuilder_FloatingObject" and args.cleanup_items:
+            #logger.info("Removing free-floating object: ",  object.find('EntityId').text)
+            logger.info("Removing free-floating object: %s %s" % (obj.find('EntityId').text, GetFloatingItemName(obj)))
+            sectorobjects.remove(obj)
+            continue #Next object
+
+        #---CubeGrid Stuff---
+        #if IsCubeGrid(object) == True:
+        if objectclass == "MyObjectBuilder_CubeGrid":
+
+            #ROTORS ARE JOINED BY PROXIMITY WHEN THE SERVER STARTS
+            #UNTIL YOU FIGURE OUT HOW TO CALCULATE THIS IN THE SAVE, JUST USE A SINGLE CLUSTER PER OBJECT
+            # AND IGNORE PRUNING ALL OBJECTS THAT HAVE ROTORS ATTACHED TO THEM
+            #objectcluster = MapObjectCluster(sectorobjects, object) #Generate the entity cluster map
+            objectcluster = [obj]
+
+            #---Always process removal stuff before modify---
+            #DO NOT REMOVE ANYTHING WITH A ROTOR OR STATOR OR PISTON unless the override is given, currently unable to map past joints
+
+            if args.columnar:
+                gridcode = blocktable["gridindex"][obj]
+
+            #print(HasJoint(objectcluster))
+            if not (columnarjoint[gridcode] if args.columnar else HasJoint(objectcluster)) or args.ignore_joint:
+                #print("Checking object: " + objectcluster[0].find('EntityId').text + " " + objectclass)
+                if args.remove_npc_ships and IsClusterAnNPC(objectcluster):
+                    #print "Removing NPC entity: " + " ,".join(objectcluster)
+                    logger.info("! Removing NPC entity: %s %s" % (obj.find('EntityId').text, FindObjectName(objectcluster))) #Just until clusters get sorted
+                    for o in objectcluster:
+                        sectorobjects.remove(o)
+                    continue #Next sector object
+
+                if args.cleanup_unpowered or len(args.cleanup_missing_attrib) > 0 or len(args.cleanup_missing_subtype) > 0: #If its cleanup o'clock and it's a CubeGrid like a station or ship
+                    #print("Do I remove this?")
+                    if args.columnar:
+                        removecluster = columnarremove[gridcode]
+                    else:
+                        removecluster = DoIRemoveThisCluster(objectcluster, args.cleanup_missing_attrib, args.cleanup_missing_subtype, args.cleanup_unpowered, args.cleanup_include_solar)
+
+                    if removecluster:
+                        #print "Removing CubeGrid entites: " + " ,".join(objectcluster)
+                        logger.info("! Removing CubeGrid") #Just until clusters get sorted
+                        for o in objectcluster:
+                            sectorobjects.remove(o)
+                        continue #Next sector object, we're removing this one anyway
+                    else:
+                        logger.info("  Entity passed check")
+                        #print("Object passes inspection: " + object.find('EntityId').text) #Just until clusters get sorted
+
+            #Remove this Else when you've got joints sussed out
+            else:
+                pass
+                #logger.info("Skipping object that has a joint: " + objectcluster[0].find('EntityId').text)
+
+            #End of If HasJoint
+
+            #---After processing removal stuff, THEN do modify stuff---
+
+            #Hand dead players' blocks over to nobody
+            if len(reassignplayers) > 0:
+                ReassignClusterOwnership(objectcluster, reassignplayers, reassigncounts)
+
+            #Add to owner list. Refinery queues are measured on the way through, before they get removed, it's the growth we're after
+            if args.columnar:
+                owners = columnarowners[gridcode]
+                metrics["largestrefineryqueue"] = max(metrics["largestrefineryqueue"], blocktable["gridqueue"][gridcode])
+            else:
+                owners = GetClusterOwners(objectcluster, metrics)
+
+            isowned = False
+            for owner in owners:
+                if owner in reassignplayers: #Doesn't own it anymore, columnar owners were worked out before the handover
+                    owner = "0"
+                owningplayers.add(owner)
+                if owner not in ("0", None):
+                    isowned = True
+
+            if isowned:
+                ownedgrids.append((obj.find('EntityId').text, GetEntityPosition(obj)))
+
+            #Turn off factories
+            #if args.disable_factories != '':
+            if len(args.disable_factories) > 0:
+                DisableFactories(objectcluster, args.disable_factories[0])
+
+            #Metrics
+            blockcount += len(obj.find('CubeBlocks'))
+
+            #Remove refinery queues
+            if args.remove_refinery_queue:
+                RemoveRefineryQueue(objectcluster)
+
+            #Turn off Spotlights
+            if args.disable_spotlights:
+                DisableSpotLights(objectcluster)
+
+            #Stop movement
+            if args.stop_movement:
+                KillClusterInertia(objectcluster)
+
+        #end CubeGrid if
+
+        #Made it to the end without removing object, go to the next item
+        entitycounts[objectclass] = entitycounts.get(objectclass, 0) + 1
+        i += 1
+
+    #End SectorObjects loop
+
+    #Sum up what's left in the sector
+    summary = {"file": sectorfilename,
+               "owners": owningplayers,
+               "reassigncounts": reassigncounts,
+               "gridpositions": [],
+               "ownedgrids": ownedgrids,
+               "characters": [],
+               "voxelmaps": [],
+               "budgetrecords": [],
+               "entitycounts": entitycounts,
+               "blocks": blockcount,
+               "largestrefineryqueue": metrics["largestrefineryqueue"]}
+
+    for obj in sectorobjects:
+        objectclass = FindAttrib(obj)
+        if objectclass == "MyObjectBuilder_CubeGrid":
+            summary["gridpositions"].append(GetEntityPosition(obj))
+            if IsBudgetEnabled(args):
+                summary["budgetrecords"].append(GetBudgetRecord([obj], args.cleanup_include_solar))
+        if objectclass == "MyObjectBuilder_Character":
+            summary["characters"].append({"id": obj.find('EntityId').text,
+                                          "file": sectorfilename,
+                                          "owner": GetCharacterOwner(obj, characterowners) if characterowners is not None else None,
+                                          "position": GetEntityPosition(obj)})
+        if objectclass == "MyObjectBuilder_VoxelMap":
+            summary["voxelmaps"].append((obj.find('Filename').text, GetEntityPosition(obj)))
+
+    if not args.whatif:
+        StageSave(xmllargesavetree, sectorfilepath, compression, args.compression_level)
+
+    return summary
+
+
+#Function to remove a list of entities from a sector's staged changes. Used once budgets & character cleanup have been worked out across the whole save
+def EvictFromSector(sectorfilepath, entityids, level=None):
+    GetWorkerLogger()
+    entityids = set(entityids)
+
+    xmllargesavetree, compression = LoadSave(GetStagedName(sectorfilepath))
+    sectorobjects = xmllargesavetree.getroot().find('SectorObjects')
+    sectorobjects[:] = [o for o in sectorobjects if o.find('EntityId') is None or o.find('EntityId').text not in entityids]
+
+    StageSave(xmllargesavetree, sectorfilepath, compression, level)
+
+
+#Function to get a short fingerprint of an XML node. If anything inside it changes, so does the fingerprint
+#Goes by tags, attributes & text only. Indentation whitespace, including the node's own tail, changes when its neighbours are added or removed, so it's left out
+def GetNodeFingerprint(node):
+    fingerprint = hashlib.blake2b(digest_size=8)
+    for elem in node.iter():
+        fingerprint.update(("<%s\0%s\0%s\0" % (elem.tag, sorted(elem.attrib.items()), (elem.text or "").strip())).encode('utf-8'))
+        fingerprint.update(b"%d>" % len(elem)) #Child count, so the nesting can't be shuffled around without it showing
+
+    return int.from_bytes(fingerprint.digest(), 'little')
+
+
+#Function to get a key for a block in a CubeGrid. Not every block has an EntityId, but no two blocks in a grid share a Min position
+#Falls back to the block's place in the list if it has neither
+def GetBlockKey(block, blocknumber):
+    if block.find('Min') is not None:
+        return "%s,%s,%s" % (block.find('Min').attrib.get("x", "0"), block.find('Min').attrib.get("y", "0"), block.find('Min').attrib.get("z", "0"))
+    if block.find('EntityId') is not None:
+        return "id:%s" % block.find('EntityId').text
+
+    return "#%d" % blocknumber
+
+
+#Function to turn an ID into something that sorts properly. EntityIds are numbers, but just in case
+def GetSortKey(idtext):
+    try:
+        return (0, int(idtext), "")
+    except (TypeError, ValueError):
+        return (1, 0, str(idtext))
+
+
+#Function to stream through a sector file and fingerprint every entity in it, without holding the whole tree in memory
+#Returns a list of (sort key, EntityId, type, fingerprint, block fingerprints) sorted by EntityId. Block fingerprints are only kept for CubeGrids
+def GetSectorFingerprints(sectorfilepath):
+    entities = []
+    stack = []
+
+    with OpenSaveFile(sectorfilepath, 'rb', GetSaveCompression(sectorfilepath)) as f:
+        for event, elem in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                stack.append(elem)
+                continue
+
+            stack.pop()
+            if len(stack) != 2 or stack[-1].tag != 'SectorObjects': #Only want the entities themselves
+                continue
+
+            objectclass = FindAttrib(elem)
+            entityid = elem.find('EntityId').text if elem.find('EntityId') is not None else None
+            blocks = None
+            if objectclass == "MyObjectBuilder_CubeGrid" and elem.find('CubeBlocks') is not None:
+                blocks = {}
+                for blocknumber, block in enumerate(elem.find('CubeBlocks')):
+                    blocks[GetBlockKey(block, blocknumber)] = GetNodeFingerprint(block)
+
+            entities.append((GetSortKey(entityid), entityid, objectclass, GetNodeFingerprint(elem), blocks))
+            stack[-1].remove(elem) #Done with it, free it up. It's always the first child left so this is quick
+
+    entities.sort(key=lambda e: e[0])
+    return entities
+
+
+#Function to walk two lists sorted by their first item side by side. Yields (old, new) pairs, either side None if it's only in one list
+def MergeJoin(oldlist, newlist):
+    i = 0
+    j = 0
+    while i < len(oldlist) or j < len(newlist):
+        if j >= len(newlist) or (i < len(oldlist) and oldlist[i][0] < newlist[j][0]):
+            yield oldlist[i], None
+            i += 1
+        elif i >= len(oldlist) or newlist[j][0] < oldlist[i][0]:
+            yield None, newlist[j]
+            j += 1
+        else:
+            yield oldlist[i], newlist[j]
+            i += 1
+            j += 1
+
+
+#Function to fingerprint the entries of one of the small save's lists, e.g. AllPlayers, keyed by one of their fields
+#Returns a list of (sort key, ID, name, fingerprint) sorted by ID
+def GetListFingerprints(listnode, idfieldname):
+    entries = []
+    if listnode is None:
+        return entries
+
+    for node in listnode:
+        if node.find(idfieldname) is None:
+            continue
+        name = SafeString(node.find('Name').text) if node.find('Name') is not None else ""
+        entries.append((GetSortKey(node.find(idfieldname).text), node.find(idfieldname).text, name, GetNodeFingerprint(node)))
+
+    entries.sort(key=lambda e: e[0])
+    return entries
+
+
+#Function to report what's changed between two lists of fingerprints from the small save
+def DiffSaveList(title, oldentries, newentries):
+    added = 0
+    removed = 0
+    modified = 0
+    for old, new in MergeJoin(oldentries, newentries):
+        if old is None:
+            logger.info("+ Added %s: %s %s" % (title, new[1], new[2]))
+            added += 1
+        elif new is None:
+            logger.info("- Removed %s: %s %s" % (title, old[1], old[2]))
+            removed += 1
+        elif old[3] != new[3]:
+            logger.info("~ Modified %s: %s %s" % (title, new[1], new[2]))
+            modified += 1
+
+    logger.info("%s: %d added, %d removed, %d modified" % (title, added, removed, modified))
+
+
+#Function to compare two saves and report what's been added, removed & changed. Doesn't change either of them
+#Sector files are streamed and fingerprinted by EntityId, then the two sorted lists are walked side by side
+def RunSaveDiff(oldsavedir, newsavedir):
+    logger.info("===Comparing %s to %s...===" % (oldsavedir, newsavedir))
+
+    #Same checks as the save being cleaned, comparing against a folder with half a save in it is meaningless
+    for savedir in (oldsavedir, newsavedir):
+        if not os.path.isfile(os.path.join(savedir, "Sandbox.sbc")):
+            logger.error("Unable to find small save: %s" % os.path.join(savedir, "Sandbox.sbc"))
+            sys.exit()
+        if len(FindSectorFiles(savedir)) == 0:
+            logger.error("Unable to find any large saves (SANDBOX_x_y_z_.sbs) in %s" % savedir)
+            sys.exit()
+
+    oldentities = []
+    for sectorfilepath in FindSectorFiles(oldsavedir):
+        logger.info("Reading %s..." % sectorfilepath)
+        oldentities += GetSectorFingerprints(sectorfilepath)
+    oldentities.sort(key=lambda e: e[0])
+
+    newentities = []
+    for sectorfilepath in FindSectorFiles(newsavedir):
+        logger.info("Reading %s..." % sectorfilepath)
+        newentities += GetSectorFingerprints(sectorfilepath)
+    newentities.sort(key=lambda e: e[0])
+
+    #Sector objects
+    logger.info("===Sector objects===")
+    added = 0
+    removed = 0
+    modified = 0
+    for old, new in MergeJoin(oldentities, newentities):
+        if old is None:
+            logger.info("+ Added %s %s" % (new[2], new[1]))
+            added += 1
+        elif new is None:
+            logger.info("- Removed %s %s" % (old[2], old[1]))
+            removed += 1
+        elif old[3] != new[3]:
+            modified += 1
+            if old[4] is None or new[4] is None:
+                logger.info("~ Modified %s %s" % (new[2], new[1]))
+                continue
+
+            #Which blocks changed inside the grid
+            addedblocks = [k for k in new[4] if k not in old[4]]
+            removedblocks = [k for k in old[4] if k not in new[4]]
+            changedblocks = [k for k in new[4] if k in old[4] and new[4][k] != old[4][k]]
+            logger.info("~ Modified %s %s: %d blocks added, %d removed, %d changed" % (new[2], new[1], len(addedblocks), len(removedblocks), len(changedblocks)))
+            for k in addedblocks:
+                logger.info("    + block at %s" % k)
+            for k in removedblocks:
+                logger.info("    - block at %s" % k)
+            for k in changedblocks:
+                logger.info("    ~ block at %s" % k)
+
+    logger.info("Sector objects: %d added, %d removed, %d modified" % (added, removed, modified))
+
+    #Players & factions from the small saves
+    oldsmallsave = LoadSave(os.path.join(oldsavedir, "Sandbox.sbc"))[0].getroot()
+    newsmallsave = LoadSave(os.path.join(newsavedir, "Sandbox.sbc"))[0].getroot()
+
+    logger.info("===Players===")
+    DiffSaveList("Player", GetListFingerprints(oldsmallsave.find('AllPlayers'), 'PlayerId'), GetListFingerprints(newsmallsave.find('AllPlayers'), 'PlayerId'))
+
+    logger.info("===Factions===")
+    oldfactions = oldsmallsave.find('Factions').find('Factions') if oldsmallsave.find('Factions') is not None else None
+    newfactions = newsmallsave.find('Factions').find('Factions') if newsmallsave.find('Factions') is not None else None
+    DiffSaveList("Faction", GetListFingerprints(oldfactions, 'FactionId'), GetListFingerprints(newfactions, 'FactionId'))
+
+
+#Function to get the name a save goes by in the metrics history. The same folder always gets the same name, however it was typed in
+def GetMetricsSaveName(savedir):
+    return os.path.normcase(os.path.abspath(savedir))
+
+
+#Function to add a metrics record to the end of the metrics history. One JSON record per line
+def AppendMetrics(metricsfilepath, record):
+    if os.path.dirname(metricsfilepath) != "" and not os.path.isdir(os.path.dirname(metricsfilepath)):
+        os.makedirs(os.path.dirname(metricsfilepath))
+
+    with open(metricsfilepath, 'a') as f:
+        f.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+#Function to load the metrics history for a save. WhatIf runs are skipped, their numbers are what the save would have been
+def LoadMetrics(metricsfilepath, savedir=None):
+    if savedir is not None:
+        savedir = GetMetricsSaveName(savedir)
+
+    records = []
+    with open(metricsfilepath, 'r') as f:
+        for line in f:
+            if line.strip() == "":
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.warning("Skipping broken line in metrics history")
+                continue
+
+            if record.get("whatif") or (savedir is not None and GetMetricsSaveName(record.get("save", "")) != savedir):
+                continue
+            records.append(record)
+
+    records.sort(key=lambda r: r["time"])
+    return records
+
+
+#Function to flatten a metrics record into name: number. Entity counts become e.g. "entities.CubeGrid"
+def GetMetricValues(record):
+    values = {}
+    for name in ("blocks", "floatingobjects", "players", "factions", "totalsize", "largestrefineryqueue"):
+        values[name] = record.get(name, 0)
+
+    values["entities"] = sum(record.get("entities", {}).values())
+    for objectclass, count in record.get("entities", {}).items():
+        values["entities." + objectclass.replace("MyObjectBuilder_", "")] = count
+
+    return values
+
+
+#Function to get the slope of a line of best fit through (x, y) points. Returns 0 if there's not enough to go on
+def GetTrendSlope(points):
+    if len(points) < 2:
+        return 0.0
+
+    meanx = sum(p[0] for p in points) / len(points)
+    meany = sum(p[1] for p in points) / len(points)
+    top = sum((p[0] - meanx) * (p[1] - meany) for p in points)
+    bottom = sum((p[0] - meanx) ** 2 for p in points)
+    if bottom == 0:
+        return 0.0
+
+    return top / bottom
+
+
+#Function to show how fast the world's been growing, and when it'll hit the given thresholds if it keeps going
+#thresholds is a dict of metric name: value
+def RunTrend(metricsfilepath, savedir, thresholds):
+    if not os.path.isfile(metricsfilepath):
+        logger.error("No metrics history yet: %s" % metricsfilepath)
+        sys.exit()
+
+    records = LoadMetrics(metricsfilepath, savedir)
+    if len(records) < 2:
+        logger.error("Need at least 2 runs in the metrics history to show a trend, found %d" % len(records))
+        sys.exit()
+
+    logger.info("===Growth trend over %d runs, %s to %s===" % (len(records), records[0]["time"], records[-1]["time"]))
+
+    starttime = datetime.datetime.strptime(records[0]["time"], "%Y-%m-%dT%H:%M:%S")
+    lasttime = datetime.datetime.strptime(records[-1]["time"], "%Y-%m-%dT%H:%M:%S")
+    series = {}
+    for record in records:
+        days = (datetime.datetime.strptime(record["time"], "%Y-%m-%dT%H:%M:%S") - starttime).total_seconds() / 86400
+        for name, value in GetMetricValues(record).items():
+            series.setdefault(name, []).append((days, value))
+
+    for name in sorted(series):
+        points = series[name]
+        slope = GetTrendSlope(points)
+        logger.info("%-30s %12s now, %+.1f per day" % (name, points[-1][1], slope))
+
+        if name in thresholds:
+            if points[-1][1] >= thresholds[name]:
+                logger.warning("%s is already over its threshold of %s" % (name, thresholds[name]))
+            elif slope <= 0:
+                logger.info("%s isn't growing, won't reach %s" % (name, thresholds[name]))
+            else:
+                when = lasttime + datetime.timedelta(days=(thresholds[name] - points[-1][1]) / slope)
+                logger.warning("%s will reach %s around %s" % (name, thresholds[name], when.strftime("%Y-%m-%d")))
+
+    for name in thresholds:
+        if name not in series:
+            logger.warning("Unknown metric in threshold: %s" % name)
+
 
 #########################################
 ### Main ################################
@@ -480,7 +1743,7 @@ def main():
     argparser.add_argument('save_path', nargs='?', help='Path to the share folder.', default='') #? used to compress into single item (not list) and will accept it if it's missing
     argparser.add_argument('--skip-backup', '-B', help='Skip backup up the save files.', default=False, action='store_true')
     argparser.add_argument('--big-backup', '-b', help='Save the backups as their own files with timestamps. Can make save folder huge after a few backups.', default=False, action='store_true')
-    argparser.add_argument('--cleanup-items', '-i', help="Clean up free floating objects like ores and components. Doesn't do corpses, they are more complicated.", default=False, action='store_true')
+    argparser.add_argument('--cleanup-items', '-i', help="Clean up free floating objects like ores and components. Doesn't do corpses, see --cleanup-characters for those.", default=False, action='store_true')
     argparser.add_argument('--prune-players', '-p', help="Removes old entries in the player list. Considered old if they don't own any blocks and either don't belong to a faction or IsDead is true. WARNING: Running this on a single-player save will force you to respawn.", default=False, action='store_true')
     argparser.add_argument('--prune-factions', '-f', help="Remove empty factions", default=False, action='store_true')
     argparser.add_argument('--whatif', '-w', help="For debugging, won't do any backups and won't save changes.", default=False, action='store_true')
@@ -497,6 +1760,25 @@ def main():
     argparser.add_argument('--cleanup-missing-subtype', '-C', help="Removes objects that are missing cubes with the given subtype, except those that have cubes that match --cleanup-missing-attrib. A list of subtypes can be found on the wiki.", nargs="*", default=[])
     argparser.add_argument('--remove-refinery-queue', '-Q', help="As of SE 01.043, the refinery queue self-replicates and can easily get out of control and cause serious lag. This removes the 'queue' node from refineries which doesn't seem to really do anything.", default=False, action='store_true')
     argparser.add_argument('--disable-spotlights', '-L', help="Turns off all spotlights.", default=False, action='store_true')
+    argparser.add_argument('--budget-grids', help="Global limit on the number of CubeGrids. When over budget, the lowest priority grids are removed until it fits. 0 for no limit.", type=int, default=0, metavar="COUNT")
+    argparser.add_argument('--budget-blocks', help="Global limit on the total number of blocks across all CubeGrids. 0 for no limit.", type=int, default=0, metavar="COUNT")
+    argparser.add_argument('--budget-owner-grids', help="Limit on the number of CubeGrids each player can own. A grid belongs to whoever owns the most blocks on it. 0 for no limit.", type=int, default=0, metavar="COUNT")
+    argparser.add_argument('--budget-owner-blocks', help="Limit on the number of blocks across all CubeGrids each player owns. 0 for no limit.", type=int, default=0, metavar="COUNT")
+    argparser.add_argument('--budget-priority', help="What makes a grid worth keeping when enforcing budgets, most important first. Defaults to: powered owned static player blocks", nargs="+", choices=BUDGETPRIORITIES, default=BUDGETPRIORITIES)
+    argparser.add_argument('--budget-player-range', help="Grids within this many units of a player character are worth more to the 'player' budget priority. Default is 1000.", type=float, default=1000, metavar="RANGE")
+    argparser.add_argument('--io-threads', help="How many file copies (backups, asteroid snapshots & respawns) can run in the background at once. Default is 4.", type=int, default=4, metavar="COUNT")
+    argparser.add_argument('--columnar', help="Loads every block into NumPy arrays up front and makes the cleanup decisions for the whole save at once. Much faster on big saves. Needs NumPy installed.", default=False, action='store_true')
+    argparser.add_argument('--reassign-dead-players', '-D', help="Removes players with IsDead set and sets the ownership of all their blocks to nobody. Reports how many blocks each player had. Only dead players are removed, the save doesn't record when players were last online so inactive ones can't be picked out.", default=False, action='store_true')
+    argparser.add_argument('--sector-workers', help="How many sector files can be checked at once, each in its own process. Default is one per CPU.", type=int, default=0, metavar="COUNT")
+    argparser.add_argument('--compression-level', help="Compression level used when writing back saves that were loaded compressed (gzip 1-9, zstd 1-22). Compressed saves are detected automatically and written back the same way. zstd needs the zstandard module.", type=int, default=None, metavar="LEVEL")
+    argparser.add_argument('--remove-duplicate-grids', '-U', help="Removes CubeGrids with exactly the same blocks (type, subtype, position & orientation) as another CubeGrid within the given range of it, keeping one of each. Grids with joints are left alone unless --ignore-joint is used.", type=float, default=0, metavar="RANGE")
+    argparser.add_argument('--diff', help="Doesn't change anything, just compares the save against another save (e.g. last night's backup) and reports which entities, blocks, players and factions were added, removed or changed.", default='', metavar="OTHER_SAVE_PATH")
+    argparser.add_argument('--metrics-file', help="Every run adds a record of the world's size (entities by type, blocks, floating objects, players, factions, file sizes, largest refinery queue) to this file. Default is ./semu_logs/metrics.jsonl", default="./semu_logs/metrics.jsonl", metavar="PATH")
+    argparser.add_argument('--trend', help="Doesn't change anything, just shows how fast the save has been growing from the metrics history. Give a save path to only look at that save's runs.", default=False, action='store_true')
+    argparser.add_argument('--trend-threshold', help="With --trend, predicts when a metric will hit a value, e.g. blocks=500000 floatingobjects=2000 entities.CubeGrid=3000", nargs="*", default=[], metavar="METRIC=VALUE")
+    argparser.add_argument('--cleanup-characters', '-K', help="Removes characters & corpses whose player is gone or dead, unless they're within the given range of an owned CubeGrid that's staying, in any sector (100 is a good start). Characters that can't be linked to a player are left alone, see --cleanup-unlinked-characters. Seated characters are never removed.", type=float, default=0, metavar="RANGE")
+    argparser.add_argument('--cleanup-unlinked-characters', help="With --cleanup-characters, also removes characters that can't be linked to any player. Older saves often don't record who a character belongs to, so this can remove logged out players' characters, making them respawn.", default=False, action='store_true')
+    argparser.add_argument('--merge-items', '-M', help="Instead of deleting free floating objects, merges objects of the same item within the given range of each other into a single stack. Only ores, ingots, components & ammo are merged, bottles and tools keep their own state. Objects are only merged into a stack within the given range of them, so nothing moves further than that. Ignored if --cleanup-items is used.", type=float, default=0, metavar="RANGE")
 
     args = argparser.parse_args()
 
@@ -543,6 +1825,29 @@ def main():
         raw_input("Press the ENTER key to exit.")
         sys.exit()
 
+    #Trend mode, just report on the metrics history and stop
+    if args.trend:
+        thresholds = {}
+        for threshold in args.trend_threshold:
+            if "=" not in threshold:
+                logger.error("Thresholds need to look like metric=value: %s" % threshold)
+                sys.exit()
+            name, value = threshold.split("=", 1)
+            try:
+                thresholds[name] = float(value)
+            except ValueError:
+                logger.error("Threshold value isn't a number: %s" % threshold)
+                sys.exit()
+
+        trendsavedir = None
+        if args.save_path != '':
+            trendsavedir = args.save_path.replace("\\", "/")
+            if trendsavedir[-1:] != "/":
+                trendsavedir = trendsavedir + "/"
+
+        RunTrend(args.metrics_file, trendsavedir, thresholds)
+        sys.exit()
+
     if args.save_path == '':
         logger.error("No save path given.")
         print(simpleusagemsg)
@@ -563,10 +1868,7 @@ def main():
 
     #Set up names
     smallsavefilename = "Sandbox.sbc"
-    largesavefilename = "SANDBOX_0_0_0_.sbs"
-
     smallsavefilepath = os.path.join(savedir, smallsavefilename)
-    largesavefilepath = os.path.join(savedir, largesavefilename)
 
     #Attempt to find the save folder
     if not os.path.isdir(savedir):
@@ -574,160 +1876,189 @@ def main():
         logger.info(savedir)
         sys.exit()
 
+    #Diff mode, just compare against another save and stop. Doesn't touch either save
+    if args.diff != '':
+        if not os.path.isdir(args.diff):
+            logger.error("Unable to load save folder to compare against.")
+            logger.info(args.diff)
+            sys.exit()
+
+        RunSaveDiff(args.diff, savedir)
+        sys.exit()
+
     #Check for save files
     if not os.path.isfile(smallsavefilepath):
         logger.error("Unable to find small save: %s" % smallsavefilename)
         sys.exit()
-    if not os.path.isfile(largesavefilepath):
-        logger.error("Unable to find small save: %s" % largesavefilename)
+
+    #Every sector file, not just SANDBOX_0_0_0_
+    largesavefilepaths = FindSectorFiles(savedir)
+    if len(largesavefilepaths) == 0:
+        logger.error("Unable to find any large saves (SANDBOX_x_y_z_.sbs)")
         sys.exit()
+    logger.info("Found %d sector(s): %s" % (len(largesavefilepaths), ", ".join(os.path.basename(p) for p in largesavefilepaths)))
+
+    if args.columnar and np is None:
+        logger.error("--columnar needs NumPy, which isn't installed.")
+        sys.exit()
+
+    #Check the compression level now, rather than finding out it's wrong when the first file gets saved
+    if args.compression_level is not None:
+        if args.compression_level < 1 or args.compression_level > 22:
+            logger.error("--compression-level has to be between 1 and 22: %d" % args.compression_level)
+            sys.exit()
+        if args.compression_level > 9 and "gzip" in [GetSaveCompression(p) for p in [smallsavefilepath] + largesavefilepaths]:
+            logger.error("--compression-level has to be between 1 and 9 for gzip compressed saves: %d" % args.compression_level)
+            sys.exit()
+
+    #File copies happen in the background so the disk & CPU can both be kept busy
+    ioexecutor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.io_threads))
+    backupjobs = []
+    asteroidjobs = []
+
+    #Save backups. Only reads the save files, and nothing gets saved until every sector is done, so they can run while the sectors are parsed & checked
+    backuptimestamp = None
+    if args.big_backup:
+        backuptimestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
 
-    #Save backups
     if not args.skip_backup and not args.whatif:
         logger.info("Saving backups...")
-        if args.big_backup:
-            timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-            smallbackupname = "%s.%s.backup" % (smallsavefilepath, timestamp)
-            largebackupname = "%s.%s.backup" % (largesavefilepath, timestamp)
-        else:
-            smallbackupname = os.path.join(smallsavefilepath, ".backup")
-            largebackupname = os.path.join(largesavefilepath, ".backup")
-
-        #print "Saving: " + smallbackupname
-        logger.info("Saving smallsave backup...")
-        shutil.copyfile(smallsavefilepath, smallbackupname)
-        #print "Saving: " + largebackupname
-        logger.info("Saving largesave backup...")
-        shutil.copyfile(largesavefilepath, largebackupname)
+        for savefilepath in [smallsavefilepath] + largesavefilepaths:
+            backupjobs.append(ioexecutor.submit(FastCopyFile, savefilepath, GetBackupName(savefilepath, backuptimestamp)))
 
     #Load saves
     logger.info("Loading %s..." % smallsavefilename)
-    xmlsmallsavetree = ET.parse(smallsavefilepath)
+    xmlsmallsavetree, smallsavecompression = LoadSave(smallsavefilepath)
     xmlsmallsave = xmlsmallsavetree.getroot()
 
-    logger.info("Loading %s file..." % largesavefilename)
-    xmllargesavetree = ET.parse(largesavefilepath)
-    xmllargesave = xmllargesavetree.getroot()
-
     logger.info("Getting Started...")
 
-    #Try to find the Sector Objects node
-    if xmllargesave.find('SectorObjects') is None:
-        logger.error("Unable to locate SectorObjects node!")
+    #Players whose stuff is getting handed over to nobody. Has to be known before the sectors are checked so it can be done on the way through
+    reassignplayers = set()
+    if args.reassign_dead_players:
+        for player in xmlsmallsave.find('AllPlayers'):
+            if player.find('IsDead') is not None and player.find('IsDead').text == 'true':
+                reassignplayers.add(player.find('PlayerId').text)
+        logger.info("Found %d dead players to remove" % len(reassignplayers))
+
+    #Who owns which character, for character cleanup
+    liveplayers = set()
+    characterowners = None
+    if args.cleanup_characters > 0:
+        liveplayers, characterowners = GetCharacterOwnerIndex(xmlsmallsave)
+
+    #Check each sector, each in its own worker. Changes are only staged, nothing gets saved until every sector has made it through
+    try:
+        sectorsummaries = RunSectorJobs(ProcessSector, [(p, args, reassignplayers, characterowners) for p in largesavefilepaths], args.sector_workers)
+    except (Exception, SystemExit) as err:
+        logger.error("Sector check failed, not saving changes: %s" % err)
+        DiscardStagedSaves(largesavefilepaths)
+        ioexecutor.shutdown(wait=True)
         sys.exit()
 
-    sectorobjects = xmllargesave.find('SectorObjects')
-
-    #Init the ownership table
-    owningplayers = []
-
-    #Big loop through entity list
-    logger.info("===Beginning SectorObject check...===")
-
-    #Rewrote to be more dynamic and to allow treating multiple entites / objects as one (motor joins). Lets call these 'object clusters'
-    #Lets always treat things as a cluster. Even if it's a cluster of 1. Will need to modify functions to match
-    #Removing clusters this way should be safe. The big concern was that if I were to start removing mid-loop, not only
-    #   would my end point be changed, but so would the current position and objects would be skipped. This way,
-    #   as long as touching any part of the cluster reveals the entire cluster, it will never remove backwards, always forwards
-    i = 0
-    while i < len(sectorobjects):
-        #---If removing an entity, DO NOT i++ !!!---
-        obj = sectorobjects[i]
-        objectclass = FindAttrib(object)
-
-        #print("Checking object")
-        #print(objectclass)
-
-        #---Process non-cubegrid stuff first---
-
-        #Remove free floating objects
-        if objectclass == "MyObjectBuilder_FloatingObject" and args.cleanup_items:
-            #logger.info("Removing free-floating object: ",  object.find('EntityId').text)
-            logger.info("Removing free-floating object: ", obj.find('EntityId').text, " ", GetFloatingItemName(object))
-            sectorobjects.remove(object)
-            continue #Next object
-
-        #---CubeGrid Stuff---
-        #if IsCubeGrid(object) == True:
-        if objectclass == "MyObjectBuilder_CubeGrid":
-
-            #ROTORS ARE JOINED BY PROXIMITY WHEN THE SERVER STARTS
-            #UNTIL YOU FIGURE OUT HOW TO CALCULATE THIS IN THE SAVE, JUST USE A SINGLE CLUSTER PER OBJECT
-            # AND IGNORE PRUNING ALL OBJECTS THAT HAVE ROTORS ATTACHED TO THEM
-            #objectcluster = MapObjectCluster(sectorobjects, object) #Generate the entity cluster map
-            objectcluster = [obj]
-
-            #---Always process removal stuff before modify---
-            #DO NOT REMOVE ANYTHING WITH A ROTOR OR STATOR OR PISTON unless the override is given, currently unable to map past joints
-
-            #print(HasJoint(objectcluster))
-            if not HasJoint(objectcluster) or args.ignore_joint:
-                #print("Checking object: " + objectcluster[0].find('EntityId').text + " " + objectclass)
-                if args.remove_npc_ships and IsClusterAnNPC(objectcluster):
-                    #print "Removing NPC entity: " + " ,".join(objectcluster)
-                    logger.info("! Removing NPC entity: ", obj.find('EntityId').text, " ", FindObjectName(objectcluster)) #Just until clusters get sorted
-                    for o in objectcluster:
-                        sectorobjects.remove(o)
-                    continue #Next sector object
-
-                if args.cleanup_unpowered or len(args.cleanup_missing_attrib) > 0 or len(args.cleanup_missing_subtype) > 0: #If its cleanup o'clock and it's a CubeGrid like a station or ship
-                    #print("Do I remove this?")
-                    if DoIRemoveThisCluster(objectcluster, args.cleanup_missing_attrib, args.cleanup_missing_subtype, args.cleanup_unpowered, args.cleanup_include_solar):
-                        #print "Removing CubeGrid entites: " + " ,".join(objectcluster)
-                        logger.info("! Removing CubeGrid") #Just until clusters get sorted
-                        for o in objectcluster:
-                            sectorobjects.remove(o)
-                        continue #Next sector object, we're removing this one anyway
-                    else:
-                        logger.info("  Entity passed check")
-                        #print("Object passes inspection: " + object.find('EntityId').text) #Just until clusters get sorted
-
-            #Remove this Else when you've got joints sussed out
-            else:
-                pass
-                #logger.info("Skipping object that has a joint: " + objectcluster[0].find('EntityId').text)
-
-            #End of If HasJoint
-
-            #---After processing removal stuff, THEN do modify stuff---
-
-            #Add to owner list
-            for owner in GetClusterOwners(objectcluster):
-                if owner not in owningplayers:
-                    owningplayers.append(owner)
-
-            #Turn off factories
-            #if args.disable_factories != '':
-            if len(args.disable_factories) > 0:
-                DisableFactories(objectcluster, args.disable_factories[0])
-
-            #Remove refinery queues
-            if args.remove_refinery_queue:
-                RemoveRefineryQueue(objectcluster)
-
-            #Turn off Spotlights
-            if args.disable_spotlights:
-                DisableSpotLights(objectcluster)
-
-            #Stop movement
-            if args.stop_movement:
-                KillClusterInertia(objectcluster)
-
-        #end CubeGrid if
+    if None in sectorsummaries:
+        logger.error("Not every sector could be checked, not saving changes")
+        DiscardStagedSaves(largesavefilepaths)
+        ioexecutor.shutdown(wait=True)
+        sys.exit()
 
-        #Made it to the end without removing object, go to the next item
-        i += 1
+    #Merge the sector summaries into the whole-save ownership & position indexes
+    owningplayers = set()
+    entitycounts = {}
+    blockcount = 0
+    largestrefineryqueue = 0
+    reassigncounts = {}
+    budgetrecords = []
+    gridpositions = []
+    ownedgrids = []
+    characters = []
+    voxelmaps = []
+    for summary in sectorsummaries:
+        owningplayers |= summary["owners"]
+        for playerID, count in summary["reassigncounts"].items():
+            reassigncounts[playerID] = reassigncounts.get(playerID, 0) + count
+        for record in summary["budgetrecords"]:
+            record["file"] = summary["file"]
+            budgetrecords.append(record)
+        gridpositions += summary["gridpositions"]
+        ownedgrids += [(summary["file"], entityid, pos) for entityid, pos in summary["ownedgrids"]]
+        characters += summary["characters"]
+        voxelmaps += summary["voxelmaps"]
+        for objectclass, count in summary["entitycounts"].items():
+            entitycounts[objectclass] = entitycounts.get(objectclass, 0) + count
+        blockcount += summary["blocks"]
+        largestrefineryqueue = max(largestrefineryqueue, summary["largestrefineryqueue"])
+
+    #Entities to take out of the staged sectors once the whole-save checks are done. File: [EntityId]
+    removebysector = {}
+
+    #Budget enforcement. Must be after the object check so it only counts what's left, and across every sector
+    evictedgrids = set()
+    if IsBudgetEnabled(args):
+        logger.info("===Beginning budget check...===")
+
+        logger.info("Grids: %d, Blocks: %d" % (len(budgetrecords), sum(r["blocks"] for r in budgetrecords)))
+        evictions = SelectBudgetEvictions(budgetrecords, args.budget_grids, args.budget_blocks, args.budget_owner_grids, args.budget_owner_blocks,
+                                          args.budget_priority, [c["position"] for c in characters], args.budget_player_range, args.ignore_joint)
+
+        for n, reason in evictions:
+            r = budgetrecords[n]
+            logger.info("! Evicting CubeGrid %s in %s, %d blocks, owner %s, powered: %s, static: %s (%s)" % (r["id"], r["file"], r["blocks"], r["owner"], r["powered"], r["static"], reason))
+            evictedgrids.add(n)
+            removebysector.setdefault(r["file"], []).append(r["id"])
+
+        if len(evictedgrids) > 0:
+            #Evicted grids don't own anything anymore
+            owningplayers = set()
+            for n in range(len(budgetrecords)):
+                if n not in evictedgrids:
+                    owningplayers.update(budgetrecords[n]["owners"])
+
+            #And don't count towards the metrics
+            entitycounts["MyObjectBuilder_CubeGrid"] -= len(evictedgrids)
+            blockcount -= sum(budgetrecords[n]["blocks"] for n in evictedgrids)
+
+        logger.info("Evicted %d grids, %d blocks" % (len(evictions), sum(budgetrecords[n]["blocks"] for n, reason in evictions)))
+    #End budget enforcement
+
+    #Character cleanup. After the budgets, so only grids that are staying, from any sector, can keep a character safe
+    if args.cleanup_characters > 0:
+        logger.info("===Beginning character cleanup...===")
+
+        evictedids = set((budgetrecords[n]["file"], budgetrecords[n]["id"]) for n in evictedgrids)
+        ownedgridpositions = [pos for f, entityid, pos in ownedgrids if (f, entityid) not in evictedids]
+        orphans = SelectOrphanedCharacters(characters, liveplayers, ownedgridpositions, args.cleanup_characters, args.cleanup_unlinked_characters)
+
+        for n in orphans:
+            removebysector.setdefault(characters[n]["file"], []).append(characters[n]["id"])
+        if len(orphans) > 0:
+            entitycounts["MyObjectBuilder_Character"] -= len(orphans)
+            orphans = set(orphans)
+            characters = [characters[n] for n in range(len(characters)) if n not in orphans]
+
+        logger.info("Removed %d orphaned characters" % len(orphans))
+    #End character cleanup
+
+    #Take the evicted grids & orphaned characters out of the affected sectors' staged changes, one pass per sector
+    if len(removebysector) > 0 and not args.whatif:
+        try:
+            RunSectorJobs(EvictFromSector, [(os.path.join(savedir, f), ids, args.compression_level) for f, ids in removebysector.items()], args.sector_workers)
+        except Exception as err:
+            logger.error("Removing evicted grids & orphaned characters failed, not saving changes: %s" % err)
+            DiscardStagedSaves(largesavefilepaths)
+            ioexecutor.shutdown(wait=True)
+            sys.exit()
 
-    #End SectorObjects loop
+    #Grids and players, for keeping asteroids from respawning on top of them
+    avoidpositions = gridpositions + [c["position"] for c in characters]
 
     #After cleanup, should be good to save snapshots
     #Asteroids
     if args.save_asteroids:
         logger.info("===Beginning asteroid snapshot...===")
-        for obj in sectorobjects:
-            if FindAttrib(object) == "MyObjectBuilder_VoxelMap":
-                #Save a copy of this entity to a backup
-                SaveAsteroid(object.find('Filename').text) #Don't worry about Print, SaveAsteroid will do that
+        for filename, pos in voxelmaps:
+            #Save a copy of this entity to a backup
+            asteroidjobs.append(SaveAsteroid(filename, savedir, asteroidsnapshotdir, ioexecutor, args.whatif)) #Don't worry about Print, SaveAsteroid will do that
     #End asteroid saving
 
     #Sector objects have now been cleaned up, lets thing about respawning
@@ -735,30 +2066,40 @@ def main():
     if args.respawn_asteroids:
         logger.info("===Beginning asteroid respawn...===")
 
-        #For efficiency, generate a list of what entites are where
-        avoidents = []
-        for obj in sectorobjects:
-            if FindAttrib(object) == "MyObjectBuilder_Character" or FindAttrib(object) == "MyObjectBuilder_CubeGrid": #Only do checks for CubeGrids and players. Who cares about floating items or other asteroids.
-                avoidents.append(object.find('PositionAndOrientation').find('Position').attrib) #Add the XYZ dict to the list
-
-        #Now, loop through the asteroids and check if they should be respawned
-        for obj in sectorobjects:
-            if FindAttrib(object) == "MyObjectBuilder_VoxelMap":
+        #Snapshots have to be finished before any of them get copied back
+        #If one of them failed, leave the asteroids alone rather than respawning from a broken snapshot
+        try:
+            WaitForIO(asteroidjobs)
+        except Exception as err:
+            logger.error("Asteroid snapshot failed, skipping respawn: %s" % err)
+            asteroidjobs = [job for job in asteroidjobs if job is not None and job.exception() is None] #Already reported, don't report them again at the end
+        else:
+            #For efficiency, index what entites are where. Only CubeGrids and players, who cares about floating items or other asteroids.
+            avoidindex = BuildSpatialIndex([(pos, None) for pos in avoidpositions], asteroidspawnrange)
 
+            #Now, loop through the asteroids and check if they should be respawned
+            for filename, pos in voxelmaps:
                 #Is it a moon or a large asteroid?
-                ismoon = ("moon" in obj.find('Filename').text)
+                ismoon = ("moon" in filename)
                 spawnrange = 0
 
-                if ismoon: spawn = moonspawnrange
-                if not ismoon: spawn = asteroidspawnrange
+                if ismoon: spawnrange = moonspawnrange
+                if not ismoon: spawnrange = asteroidspawnrange
 
-                if CanRespawnAsteroid(avoidents, obj.find('PositionAndOrientation').find('Position').attrib, spawnrange):
-                    RestoreAsteroid(object.find('Filename').text)
+                if CanRespawnAsteroid(avoidindex, asteroidspawnrange, pos, spawnrange):
+                    asteroidjobs.append(RestoreAsteroid(filename, savedir, asteroidsnapshotdir, ioexecutor, args.whatif))
 
                 else:
-                    logger.info("Can't respawn asteroid, something is too close: " + obj.find('Filename').text)
+                    logger.info("Can't respawn asteroid, something is too close: " + filename)
     #End asteroid respawning
 
+    #Remove dead players. Their stuff has already been handed over in the object check
+    if len(reassignplayers) > 0:
+        logger.info("===Removing dead players...===")
+        for playerID in sorted(reassignplayers):
+            logger.info("Reassigned %d blocks from dead player %s to nobody" % (reassigncounts.get(playerID, 0), playerID))
+        RemovePlayers(xmlsmallsave, reassignplayers)
+
     #Begin player check. Must be after object check
     if args.prune_players:
         logger.info("===Beginning player check...===")
@@ -797,45 +2138,7 @@ def main():
         #Remove from relevant lists
         if len(playerIDtoremove) > 0: #If there's things to do
             logger.info("===Removing marked players...===")
-
-            #AllPlayers section
-            for player in playerlist[:]:
-                if player.find('PlayerId').text in playerIDtoremove:
-                    logger.info("Removing ", player.find('PlayerId').text, " from All Players list")
-                    playerlist.remove(player)
-
-            #Players section. Yes, there's a second one
-            pllist = xmlsmallsave.find('Players')[0]
-            for player in pllist[:]:
-                if player.find('Value').find('PlayerId') in playerIDtoremove:
-                    logger.info("Removing ", player.find('Value').find('PlayerId'), " from Players list")
-                    pllist.remove(player)
-
-            #Factions
-            #Loop through members of each faction.
-            for faction in xmlsmallsave.find('Factions').find('Factions'):
-                factionId = faction.find('FactionId').text
-                memberlist = faction.find('Members')
-                joinrequests = faction.find('JoinRequests')
-
-                #Cleanup Members
-                for member in memberlist[:]:
-                    if member.find('PlayerId').text in playerIDtoremove:
-                        logger.info("Removing ", member.find('PlayerId').text, " from faction ", factionId, " ", faction.find('Name').text)
-                        memberlist.remove(member)
-
-                #Cleanup Join Requests
-                for joinrequest in joinrequests[:]:
-                    if joinrequest.find('PlayerId').text in playerIDtoremove:
-                        logger.info("Removing ", joinrequest.find('PlayerId').text, " from faction request list ", factionId, " ", faction.find('Name').text)
-                        joinrequests.remove(joinrequest)
-
-            #Factions Players, yep another second one
-            factionplayers = xmlsmallsave.find('Factions').find('Players')[0]
-            for factionplayer in factionplayers[:]:
-                if factionplayer.find('Key').text in playerIDtoremove:
-                    logger.info("Removing ", factionplayer.find('Key').text, "from faction player list")
-                    factionplayers.remove(factionplayer)
+            RemovePlayers(xmlsmallsave, playerIDtoremove)
 
     #End player pruning
 
@@ -848,6 +2151,8 @@ def main():
 
         if xmlsmallsave.find('Factions') is None:
             logger.error("Unable to location the Factions node in save!")
+            DiscardStagedSaves(largesavefilepaths)
+            ioexecutor.shutdown(wait=True)
             sys.exit()
 
         #Find and mark down factions to be removed
@@ -891,17 +2196,48 @@ def main():
 
     #Ok, that should be all the checks, lets save it
     if not args.whatif:
+        #Don't touch the save until the backups are safely on disk
+        logger.info("Waiting for backups to finish...")
+        try:
+            WaitForIO(backupjobs)
+        except Exception as err:
+            logger.error("Backup failed, not saving changes: %s" % err)
+            DiscardStagedSaves(largesavefilepaths)
+            ioexecutor.shutdown(wait=True)
+            sys.exit()
+
+        #Everything is staged and backed up, swap it all in
         logger.info("===Saving changes...===")
-        logger.info("Saving largesave...")
-        xmllargesave.attrib["xmlns:xsd"] = "http://www.w3.org/2001/XMLSchema"
-        xmllargesavetree.write(largesavefilepath)
-
-        logger.info("Saving smallsave...")
-        #Space Engineers freaks the fuck out if the top of the XML in the sbc file isn't juuuuuuust right
-        xmlsmallsave.attrib["xmlns:xsd"] = "http://www.w3.org/2001/XMLSchema"
-        xmlsmallsavetree.write(smallsavefilepath)
+        StageSave(xmlsmallsavetree, smallsavefilepath, smallsavecompression, args.compression_level)
+        CommitStagedSaves([smallsavefilepath] + largesavefilepaths)
     else:
         logger.info("===Script complete. WhatIf was used, no action has been taken.===")
 
+    #Let any asteroid copies finish up before leaving
+    try:
+        WaitForIO(asteroidjobs)
+    except Exception as err:
+        logger.error("Asteroid snapshot / respawn failed: %s" % err)
+    ioexecutor.shutdown(wait=True)
+
+    #Add this run to the metrics history
+    filesizes = {}
+    for savefilepath in [smallsavefilepath] + largesavefilepaths:
+        filesizes[os.path.basename(savefilepath)] = os.path.getsize(savefilepath)
+
+    AppendMetrics(args.metrics_file, {"time": datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+                                      "save": GetMetricsSaveName(savedir),
+                                      "whatif": args.whatif,
+                                      "entities": entitycounts,
+                                      "blocks": blockcount,
+                                      "floatingobjects": entitycounts.get("MyObjectBuilder_FloatingObject", 0),
+                                      "players": len(xmlsmallsave.find('AllPlayers')),
+                                      "factions": len(xmlsmallsave.find('Factions').find('Factions')) if xmlsmallsave.find('Factions') is not None else 0,
+                                      "filesizes": filesizes,
+                                      "totalsize": sum(filesizes.values()),
+                                      "largestrefineryqueue": largestrefineryqueue})
+    logger.info("Metrics recorded to %s" % args.metrics_file)
+
 if __name__ == '__main__':
+    multiprocessing.freeze_support() #Semu.exe needs this, or every sector worker runs the whole thing again
     main()